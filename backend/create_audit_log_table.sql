@@ -4,7 +4,7 @@ create table if not exists public.agent_audit_logs (
   created_at timestamp with time zone default timezone('utc'::text, now()) not null,
   user_id uuid references auth.users(id) on delete cascade not null,
   query_id text not null,
-  action_type text not null, -- 'LLM_THINK', 'TOOL_EXEC', 'ERROR', 'SYSTEM'
+  action_type text not null, -- 'TASK_START', 'LLM_THINK', 'TOOL_EXEC', 'ERROR', 'SYSTEM', 'EXECUTION_*'
   details jsonb default '{}'::jsonb
 );
 
@@ -20,3 +20,19 @@ create policy "Users can insert their own logs"
 create policy "Users can view their own logs"
   on public.agent_audit_logs for select
   using (auth.uid() = user_id);
+
+-- Indexes for the execution-trace API (keyset pagination on (created_at, id))
+-- One task's events in order: /api/traces/{user_id}/{query_id}
+create index if not exists agent_audit_logs_query_id_created_at_idx
+  on public.agent_audit_logs (query_id, created_at, id);
+
+-- A user's task list, newest first: /api/traces/list/{user_id}
+create index if not exists agent_audit_logs_user_task_start_idx
+  on public.agent_audit_logs (user_id, created_at desc, id desc)
+  where action_type = 'TASK_START';
+
+-- One-off backfill: tasks logged before TASK_START existed only have a SYSTEM start row
+update public.agent_audit_logs
+  set action_type = 'TASK_START',
+      details = details || jsonb_build_object('query', substr(details->>'message', length('Starting task: ') + 1))
+  where action_type = 'SYSTEM' and details->>'message' like 'Starting task:%';
@@ -1,3 +1,6 @@
+import time
+PROCESS_START = time.perf_counter()
+
 from fastapi import FastAPI, Request, HTTPException, Depends, WebSocket, WebSocketDisconnect
 from fastapi.responses import RedirectResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,15 +12,19 @@ import asyncio
 import traceback
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
-from supabase import create_client, Client
-import openai
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request as GoogleRequest
 import requests
-from datetime import datetime
-from playwright.async_api import async_playwright
+from datetime import datetime, timezone
 import random
+import sys
+import importlib
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+import heapq
+import itertools
+import psutil
+from email.utils import parsedate_to_datetime
 
 # Load environment variables
 load_dotenv()
@@ -29,10 +36,21 @@ from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global playwright_instance
-    print("[System] Starting Global Playwright Engine...")
-    playwright_instance = await async_playwright().start()
+    global warmup_task
+    startup_timings["app_import_ms"] = elapsed_ms(PROCESS_START)
+    if STARTUP_MODE == "eager":
+        await warm_up_engines()
+    else:
+        # Heavy clients and Playwright start after the port is open; /readyz reports progress
+        warmup_task = asyncio.create_task(warm_up_engines())
+    reaper = asyncio.create_task(task_manager.run_reaper())
     yield
+    print("[System] Cancelling running tasks...")
+    await task_manager.cancel_all("Server shutting down")
+    reaper.cancel()
+    capture_service.shutdown()
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
     print("[System] Stopping Global Playwright Engine...")
     if playwright_instance:
         await playwright_instance.stop()
@@ -56,9 +74,102 @@ GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 GOOGLE_CALLBACK_URL = os.getenv("GOOGLE_CALLBACK_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Initialize Clients
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai.api_key = OPENAI_API_KEY
+# Task Lifecycle Limits (seconds)
+TASK_DEADLINE_SECONDS = float(os.getenv("TASK_DEADLINE_SECONDS", "600"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "60"))
+WAIT_FOR_USER_MAX_SECONDS = int(os.getenv("WAIT_FOR_USER_MAX_SECONDS", "120"))
+WS_DISCONNECT_GRACE_SECONDS = float(os.getenv("WS_DISCONNECT_GRACE_SECONDS", "30"))
+REAPER_INTERVAL_SECONDS = float(os.getenv("REAPER_INTERVAL_SECONDS", "60"))
+BROWSER_CLOSE_TIMEOUT_SECONDS = 10
+
+# --- 🚀 Lazy Startup & Engine Warm-up ---
+
+# "lazy": serve immediately and warm up in the background; "eager": warm up before serving
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+
+engine_state = {"openai": "pending", "supabase": "pending", "playwright": "pending"}
+import_timings: dict[str, float] = {}
+startup_timings: dict[str, float] = {}
+warmup_task = None
+
+_supabase_client = None
+_openai_client = None
+# Clients may be built by the warm-up thread and the event loop at the same time
+_client_lock = threading.Lock()
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def lazy_import(module_name: str):
+    """Imports a heavy module on first use and records how long it took."""
+    # Always go through import_module: it waits on the per-module import lock, so a
+    # caller racing the warm-up thread never sees a partially initialised module
+    already_loaded = module_name in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if not already_loaded:
+        import_timings.setdefault(module_name, elapsed_ms(start))
+    return module
+
+def get_supabase():
+    global _supabase_client
+    if _supabase_client is None:
+        with _client_lock:
+            if _supabase_client is None:
+                _supabase_client = lazy_import("supabase").create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase_client
+
+def get_openai():
+    openai = lazy_import("openai")
+    openai.api_key = OPENAI_API_KEY
+    return openai
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _client_lock:
+            if _openai_client is None:
+                _openai_client = get_openai().AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+def is_openai_rate_limit(e: Exception) -> bool:
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(e, openai.RateLimitError)
+
+async def warm_up_engines():
+    global playwright_instance
+    start = time.perf_counter()
+    for name, init in (("openai", get_openai_client), ("supabase", get_supabase)):
+        engine_state[name] = "warming"
+        step_start = time.perf_counter()
+        try:
+            await asyncio.to_thread(init)
+            engine_state[name] = "ready"
+        except Exception as e:
+            engine_state[name] = "failed"
+            print(f"[System] {name} init failed: {e}")
+        startup_timings[f"{name}_init_ms"] = elapsed_ms(step_start)
+
+    print("[System] Starting Global Playwright Engine...")
+    engine_state["playwright"] = "warming"
+    step_start = time.perf_counter()
+    try:
+        async_api = await asyncio.to_thread(lazy_import, "playwright.async_api")
+        playwright_instance = await async_api.async_playwright().start()
+        engine_state["playwright"] = "ready"
+    except Exception as e:
+        engine_state["playwright"] = "failed"
+        print(f"[System] Playwright start failed: {e}")
+    startup_timings["playwright_start_ms"] = elapsed_ms(step_start)
+    startup_timings["warmup_ms"] = elapsed_ms(start)
+    startup_timings["ready_after_ms"] = elapsed_ms(PROCESS_START)
+    print(f"[System] Warm-up finished: {engine_state} in {startup_timings['warmup_ms']}ms")
+
+async def get_playwright():
+    """Waits for background warm-up (without letting a cancelled task cancel it)."""
+    if warmup_task and not warmup_task.done():
+        await asyncio.shield(warmup_task)
+    return playwright_instance
 
 # Google OAuth Configuration
 SCOPES = [
@@ -77,9 +188,9 @@ def decrypt_token(encrypted_token: str) -> str:
     return encrypted_token
 
 # --- 🔄 Token Refresh Utility ---
-def get_valid_access_token(user_id: str):
+async def get_valid_access_token(user_id: str):
     try:
-        response = supabase.table('oauth_tokens').select('refresh_token').eq('user_id', user_id).single().execute()
+        response = get_supabase().table('oauth_tokens').select('refresh_token').eq('user_id', user_id).single().execute()
         if not response.data:
             raise Exception("User token not found")
             
@@ -93,7 +204,7 @@ def get_valid_access_token(user_id: str):
             'grant_type': 'refresh_token'
         }
         
-        refresh_response = requests.post(token_url, data=data)
+        refresh_response = await rate_limited_call("oauth_token", user_id, requests.post, token_url, data=data)
         if refresh_response.status_code != 200:
             raise Exception(f"Failed to refresh token: {refresh_response.text}")
             
@@ -114,11 +225,19 @@ class ConnectionManager:
         self.active_connections[user_id] = websocket
         print(f"[WS] User {user_id} connected")
 
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
+    def disconnect(self, user_id: str, websocket: WebSocket):
+        # A stale socket closing late must not drop the user's newer connection
+        if self.active_connections.get(user_id) is websocket:
             del self.active_connections[user_id]
             print(f"[WS] User {user_id} disconnected")
 
+    async def send_bytes(self, user_id: str, data: bytes):
+        if user_id in self.active_connections:
+            try:
+                await self.active_connections[user_id].send_bytes(data)
+            except Exception as e:
+                print(f"[WS] Error sending bytes to {user_id}: {e}")
+
     async def send_payload(self, user_id: str, payload: dict):
         if user_id in self.active_connections:
             try:
@@ -128,6 +247,357 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+# --- 🧹 Task Lifecycle & Browser Reclamation ---
+
+def new_query_id() -> str:
+    return f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{random.randint(1000,9999)}"
+
+async def close_browser_resources(context, browser):
+    """Closes a context and browser independently so one failure never leaks the other."""
+    for resource in (context, browser):
+        if resource is None:
+            continue
+        try:
+            await asyncio.wait_for(resource.close(), timeout=BROWSER_CLOSE_TIMEOUT_SECONDS)
+        except Exception as e:
+            print(f"[Cleanup] Failed to close {type(resource).__name__}: {e}")
+
+def chromium_roots() -> set[int]:
+    """PIDs of top-level Chromium processes in our process tree (renderers etc. hang off these)."""
+    roots = set()
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            if "chrom" in proc.name().lower() and "chrom" not in proc.parent().name().lower():
+                roots.add(proc.pid)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
+            pass
+    return roots
+
+def kill_process_tree(pid: int):
+    try:
+        root = psutil.Process(pid)
+        for child in root.children(recursive=True):
+            child.kill()
+        root.kill()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        pass
+
+class TaskManager:
+    """
+    Tracks running ReAct tasks so they can be cancelled by id, by deadline,
+    or when their user's WebSocket goes away, and reaps anything left behind.
+    """
+    def __init__(self):
+        self.running_tasks: dict[str, asyncio.Task] = {}
+        self.task_owners: dict[str, str] = {}
+        self.started_at: dict[str, float] = {}
+        self.cancel_reasons: dict[str, str] = {}
+        self.deadline_handles: dict[str, asyncio.TimerHandle] = {}
+        self.browser_resources: dict[str, tuple] = {}
+        self.browser_pids: dict[str, set[int]] = {}
+        self.launch_lock = asyncio.Lock()
+        self.grace_timers: dict[str, asyncio.Task] = {}
+
+    def register(self, query_id: str, user_id: str, task: asyncio.Task):
+        self.running_tasks[query_id] = task
+        self.task_owners[query_id] = user_id
+        self.started_at[query_id] = time.monotonic()
+        self.deadline_handles[query_id] = asyncio.get_running_loop().call_later(
+            TASK_DEADLINE_SECONDS, self.cancel, query_id, f"Deadline of {int(TASK_DEADLINE_SECONDS)}s exceeded"
+        )
+        task.add_done_callback(lambda _: self.unregister(query_id))
+
+    def unregister(self, query_id: str):
+        self.running_tasks.pop(query_id, None)
+        self.task_owners.pop(query_id, None)
+        self.started_at.pop(query_id, None)
+        self.cancel_reasons.pop(query_id, None)
+        handle = self.deadline_handles.pop(query_id, None)
+        if handle:
+            handle.cancel()
+
+    def track_browser(self, query_id: str, context, browser):
+        self.browser_resources[query_id] = (context, browser)
+
+    def release_browser(self, query_id: str):
+        self.browser_resources.pop(query_id, None)
+        self.browser_pids.pop(query_id, None)
+
+    @asynccontextmanager
+    async def attributing_launch(self, query_id: str):
+        """Serialises browser launches so the new Chromium root PIDs can be attributed to this task."""
+        async with self.launch_lock:
+            before = chromium_roots()
+            try:
+                yield
+            finally:
+                self.browser_pids.setdefault(query_id, set()).update(chromium_roots() - before)
+
+    def tasks_for_user(self, user_id: str) -> list[str]:
+        return [qid for qid, owner in self.task_owners.items() if owner == user_id]
+
+    def cancel(self, query_id: str, reason: str) -> bool:
+        task = self.running_tasks.get(query_id)
+        if not task or task.done():
+            return False
+        print(f"[Tasks] Cancelling {query_id}: {reason}")
+        self.cancel_reasons.setdefault(query_id, reason)
+        task.cancel()
+        return True
+
+    def cancel_reason(self, query_id: str) -> str:
+        return self.cancel_reasons.get(query_id, "Cancelled")
+
+    async def cancel_all(self, reason: str):
+        tasks = [t for qid, t in list(self.running_tasks.items()) if self.cancel(qid, reason)]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- WebSocket disconnect grace period ---
+
+    def schedule_disconnect_cancel(self, user_id: str):
+        self.clear_disconnect_cancel(user_id)
+        if self.tasks_for_user(user_id):
+            self.grace_timers[user_id] = asyncio.create_task(self._cancel_after_grace(user_id))
+
+    def clear_disconnect_cancel(self, user_id: str):
+        timer = self.grace_timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+
+    async def _cancel_after_grace(self, user_id: str):
+        await asyncio.sleep(WS_DISCONNECT_GRACE_SECONDS)
+        self.grace_timers.pop(user_id, None)
+        if user_id in manager.active_connections:
+            return
+        for query_id in self.tasks_for_user(user_id):
+            self.cancel(query_id, "Client disconnected")
+
+    # --- Reaper ---
+
+    async def reap_orphans(self):
+        # 1. Browsers whose owning task has already finished
+        for query_id, (context, browser) in list(self.browser_resources.items()):
+            if query_id not in self.running_tasks:
+                print(f"[Reaper] Closing orphaned browser from {query_id}")
+                self.release_browser(query_id)
+                await close_browser_resources(context, browser)
+
+        # 2. Tasks that ignored their deadline (e.g. stuck in a blocking call)
+        overdue = TASK_DEADLINE_SECONDS + REAPER_INTERVAL_SECONDS
+        now = time.monotonic()
+        for query_id, started in list(self.started_at.items()):
+            if now - started > overdue:
+                self.cancel(query_id, "Reaped after missing deadline")
+
+        # 3. Chromium process trees not owned by any live task (skipped mid-launch,
+        #    when new PIDs are not yet attributed)
+        if not self.launch_lock.locked():
+            live = set().union(*(pids for qid, pids in self.browser_pids.items() if qid in self.running_tasks))
+            for pid in chromium_roots() - live:
+                print(f"[Reaper] Killing orphaned browser process {pid}")
+                kill_process_tree(pid)
+
+    async def run_reaper(self):
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+            try:
+                await self.reap_orphans()
+            except Exception as e:
+                print(f"[Reaper] Error: {e}")
+
+task_manager = TaskManager()
+
+# --- 🚦 Outbound Rate Limiting ---
+
+# Requests per second ("rate"), bucket size ("burst") and the same per user.
+# Override any entry with the RATE_LIMITS env var, e.g. '{"gmail": {"rate": 5}}'.
+RATE_LIMIT_DEFAULTS = {
+    "openai:gpt-4o": {"rate": 8.0, "burst": 16, "user_rate": 2.0, "user_burst": 4},
+    "gmail": {"rate": 2.0, "burst": 5, "user_rate": 0.5, "user_burst": 2},
+    "docs": {"rate": 5.0, "burst": 10, "user_rate": 1.0, "user_burst": 3},
+    "oauth_token": {"rate": 5.0, "burst": 10, "user_rate": 0.5, "user_burst": 2},
+    # Used for any upstream without its own entry
+    "default": {"rate": 2.0, "burst": 5, "user_rate": 0.5, "user_burst": 2},
+}
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+
+def load_rate_limit_budgets() -> dict:
+    budgets = {name: dict(cfg) for name, cfg in RATE_LIMIT_DEFAULTS.items()}
+    try:
+        overrides = json.loads(os.getenv("RATE_LIMITS", "{}"))
+    except json.JSONDecodeError as e:
+        print(f"[RateLimit] Ignoring invalid RATE_LIMITS: {e}")
+        overrides = {}
+    for name, cfg in overrides.items():
+        if name not in budgets:
+            print(f"[RateLimit] RATE_LIMITS adds unknown upstream '{name}', starting from the default budget")
+            budgets[name] = dict(RATE_LIMIT_DEFAULTS["default"])
+        budgets[name].update(cfg)
+    return budgets
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, cost: float = 1.0) -> float:
+        self._refill()
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1.0):
+        self._refill()
+        self.tokens -= cost
+
+    async def take(self, cost: float = 1.0):
+        while (wait := self.time_until(cost)) > 0:
+            await asyncio.sleep(wait)
+        self.consume(cost)
+
+class UpstreamLimiter:
+    """
+    Token bucket for one upstream, shared across users with weighted fair queuing:
+    each request gets a virtual finish tag and the smallest tag is admitted first,
+    so a bursty user cannot starve others. A per-user bucket caps each user's share.
+    """
+    def __init__(self, name: str, rate: float, burst: float, user_rate: float, user_burst: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_buckets: dict[str, TokenBucket] = {}
+        self.last_finish: dict[str, float] = {}
+        self.virtual_time = 0.0
+        self.queue: list = []
+        self.sequence = itertools.count()
+        self.blocked_until = 0.0
+        self.dispatcher = None
+        self.throttled_count = 0
+
+    async def acquire(self, user_id: str, weight: float = 1.0, cost: float = 1.0):
+        if user_id not in self.user_buckets:
+            self.user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        await self.user_buckets[user_id].take(cost)
+
+        start = max(self.virtual_time, self.last_finish.get(user_id, 0.0))
+        finish = start + cost / weight
+        self.last_finish[user_id] = finish
+
+        admitted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (finish, next(self.sequence), cost, admitted))
+        if not self.dispatcher or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        await admitted
+
+    async def _dispatch(self):
+        while self.queue:
+            blocked = self.blocked_until - time.monotonic()
+            if blocked > 0:
+                await asyncio.sleep(blocked)
+                continue
+            finish, _, cost, admitted = self.queue[0]
+            if admitted.done():
+                heapq.heappop(self.queue)
+                continue
+            wait = self.bucket.time_until(cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self.queue)
+            self.bucket.consume(cost)
+            self.virtual_time = finish
+            admitted.set_result(None)
+        # Drop finish tags that can no longer affect ordering, and per-user buckets
+        # that have refilled (a fresh bucket is identical, and nobody can be waiting on a full one)
+        self.last_finish = {u: f for u, f in self.last_finish.items() if f > self.virtual_time}
+        self.user_buckets = {
+            u: b for u, b in self.user_buckets.items() if b.time_until(b.capacity) > 0
+        }
+
+    def penalize(self, retry_after: float):
+        self.throttled_count += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def snapshot(self) -> dict:
+        return {
+            "rate": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "user_rate": self.user_rate,
+            "user_burst": self.user_burst,
+            "queued": len(self.queue),
+            "throttled_count": self.throttled_count,
+            "blocked_for": max(0.0, round(self.blocked_until - time.monotonic(), 2)),
+        }
+
+class RateLimiter:
+    def __init__(self, budgets: dict):
+        self.budgets = budgets
+        self.limiters: dict[str, UpstreamLimiter] = {}
+
+    def get(self, upstream: str) -> UpstreamLimiter:
+        if upstream not in self.limiters:
+            cfg = self.budgets.get(upstream)
+            if cfg is None:
+                print(f"[RateLimit] No budget for upstream '{upstream}', using the default budget")
+                cfg = self.budgets["default"]
+            self.limiters[upstream] = UpstreamLimiter(
+                upstream, cfg["rate"], cfg["burst"], cfg["user_rate"], cfg["user_burst"]
+            )
+        return self.limiters[upstream]
+
+rate_limiter = RateLimiter(load_rate_limit_budgets())
+
+def parse_retry_after(value, attempt: int) -> float:
+    """Retry-After may be delta-seconds or an HTTP date; fall back to exponential backoff."""
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return float(2 ** attempt)
+
+async def _rate_limited(upstream: str, user_id: str, invoke):
+    """
+    Awaits invoke() once the limiter admits it.
+    429 responses (requests) and RateLimitError (OpenAI) pause the whole upstream
+    for Retry-After and are retried up to RATE_LIMIT_MAX_RETRIES times.
+    """
+    limiter = rate_limiter.get(upstream)
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        await limiter.acquire(user_id)
+        try:
+            result = await invoke()
+        except Exception as e:
+            if not is_openai_rate_limit(e) or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            delay = parse_retry_after(e.response.headers.get("retry-after"), attempt)
+        else:
+            if getattr(result, "status_code", None) != 429 or attempt == RATE_LIMIT_MAX_RETRIES:
+                return result
+            delay = parse_retry_after(result.headers.get("Retry-After"), attempt)
+        print(f"[RateLimit] {upstream} throttled for {user_id}, retrying in {delay:.1f}s")
+        limiter.penalize(delay)
+
+async def rate_limited_call(upstream: str, user_id: str, fn, *args, **kwargs):
+    """Rate-limited blocking call, run off-loop."""
+    return await _rate_limited(upstream, user_id, lambda: asyncio.to_thread(fn, *args, **kwargs))
+
+async def rate_limited_acall(upstream: str, user_id: str, fn, *args, **kwargs):
+    """Rate-limited call to an async client method."""
+    return await _rate_limited(upstream, user_id, lambda: fn(*args, **kwargs))
+
 # --- 🛠️ Tool Configuration & Modular System ---
 
 EXTERNAL_TOOLS_CONFIG = {
@@ -220,7 +690,7 @@ CORE_TOOLS = [
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "seconds": {"type": "integer", "description": "Number of seconds to wait."}
+                    "seconds": {"type": "integer", "minimum": 1, "description": "Number of seconds to wait."}
                 },
                 "required": ["seconds"]
             }
@@ -266,9 +736,166 @@ def generate_tool_definitions():
 
 # Initialize Tools
 tools = generate_tool_definitions()
+TOOL_SPECS = {tool["function"]["name"]: tool["function"] for tool in tools}
+
+JSON_SCHEMA_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "object": dict,
+    "array": list,
+}
+
+def compile_validator(schema: dict):
+    """
+    Precompiles the JSON-schema subset our tools use (properties, required, type,
+    enum, minimum, maximum, additionalProperties) into a function returning a list of errors.
+    """
+    required = tuple(schema.get("required", []))
+    checks = [
+        (prop, spec.get("type"), JSON_SCHEMA_TYPES.get(spec.get("type")), spec.get("enum"), spec.get("minimum"), spec.get("maximum"))
+        for prop, spec in schema.get("properties", {}).items()
+    ]
+    allowed = None if schema.get("additionalProperties", True) else frozenset(schema.get("properties", {}))
+
+    def validate(args) -> list[str]:
+        if not isinstance(args, dict):
+            return ["arguments must be a JSON object"]
+        errors = [f"missing required argument '{name}'" for name in required if name not in args]
+        for prop, type_name, expected, enum, minimum, maximum in checks:
+            if prop not in args:
+                continue
+            value = args[prop]
+            # bool is a subclass of int, so reject it explicitly for numeric types
+            if expected and (not isinstance(value, expected) or (isinstance(value, bool) and type_name in ("integer", "number"))):
+                errors.append(f"'{prop}' must be of type {type_name}")
+                continue
+            if enum is not None and value not in enum:
+                errors.append(f"'{prop}' must be one of {enum}")
+            if minimum is not None and value < minimum:
+                errors.append(f"'{prop}' must be >= {minimum}")
+            if maximum is not None and value > maximum:
+                errors.append(f"'{prop}' must be <= {maximum}")
+        if allowed is not None:
+            errors.extend(f"unexpected argument '{name}'" for name in args if name not in allowed)
+        return errors
+
+    return validate
+
+@dataclass
+class ToolContext:
+    page: object
+    user_id: str
+    query_id: str
+    access_token: str
+
+@dataclass
+class RegisteredTool:
+    name: str
+    description: str
+    parameters: dict
+    handler: object
+    validate: object
+    timeout: float
+    terminal: bool = False
+
+class ToolRegistry:
+    """
+    Binds tool definitions to async handlers. Arguments are checked by a precompiled
+    validator before dispatch, so malformed calls fail instantly with a structured
+    observation instead of deep inside Playwright or a Google API.
+    """
+    def __init__(self):
+        self.tools: dict[str, RegisteredTool] = {}
+        self.metrics: dict[str, dict] = {}
+        self._definitions = None
+
+    def tool(self, name: str, description: str = None, parameters: dict = None, timeout: float = None, terminal: bool = False):
+        """Decorator registering handler(ctx, args) -> str. Definitions default to TOOL_SPECS."""
+        spec = TOOL_SPECS.get(name, {})
+        description = description or spec.get("description")
+        parameters = parameters or spec.get("parameters")
+        for field, value in (("description", description), ("parameters", parameters)):
+            if value is None:
+                raise ValueError(f"Tool '{name}' has no {field}: pass {field}= or add it to CORE_TOOLS / EXTERNAL_TOOLS_CONFIG")
+
+        def decorator(handler):
+            self.tools[name] = RegisteredTool(
+                name, description, parameters, handler, compile_validator(parameters),
+                timeout or TOOL_TIMEOUT_SECONDS, terminal
+            )
+            self.metrics[name] = {"calls": 0, "errors": 0, "timeouts": 0, "invalid": 0, "total_ms": 0.0, "max_ms": 0.0}
+            self._definitions = None
+            return handler
+        return decorator
+
+    def definitions(self) -> list:
+        if self._definitions is None:
+            self._definitions = [
+                {"type": "function", "function": {"name": t.name, "description": t.description, "parameters": t.parameters}}
+                for t in self.tools.values()
+            ]
+        return self._definitions
+
+    def resolve(self, name: str, raw_arguments: str):
+        """Returns (tool, args, None) or (None, None, error_observation)."""
+        tool = self.tools.get(name)
+        if tool is None:
+            return None, None, json.dumps({"error": "unknown_tool", "tool": name, "available": list(self.tools)})
+        try:
+            args = json.loads(raw_arguments or "{}")
+        except json.JSONDecodeError as e:
+            self.metrics[name]["invalid"] += 1
+            return None, None, json.dumps({"error": "malformed_arguments", "tool": name, "details": [str(e)]})
+        errors = tool.validate(args)
+        if errors:
+            self.metrics[name]["invalid"] += 1
+            return None, None, json.dumps({"error": "invalid_arguments", "tool": name, "details": errors})
+        return tool, args, None
+
+    async def call(self, tool: RegisteredTool, ctx: ToolContext, args: dict) -> str:
+        metrics = self.metrics[tool.name]
+        metrics["calls"] += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(tool.handler(ctx, args), timeout=tool.timeout)
+        except asyncio.TimeoutError:
+            metrics["timeouts"] += 1
+            raise
+        except Exception:
+            metrics["errors"] += 1
+            raise
+        finally:
+            duration = elapsed_ms(start)
+            metrics["total_ms"] += duration
+            metrics["max_ms"] = max(metrics["max_ms"], duration)
+
+    def snapshot(self) -> dict:
+        return {
+            name: {**m, "avg_ms": round(m["total_ms"] / m["calls"], 1) if m["calls"] else 0.0}
+            for name, m in self.metrics.items()
+        }
+
+tool_registry = ToolRegistry()
 
 # --- ⚖️ Compliance & Status ---
 
+@app.get("/api/rate-limits/status")
+def get_rate_limit_status():
+    return {
+        "budgets": rate_limiter.budgets,
+        "upstreams": {name: limiter.snapshot() for name, limiter in rate_limiter.limiters.items()}
+    }
+
+@app.get("/api/tools/metrics")
+def get_tool_metrics():
+    return {"tools": tool_registry.snapshot()}
+
+@app.get("/api/capture/stats")
+def get_capture_stats():
+    return capture_service.snapshot()
+
 @app.get("/api/compliance/status")
 def get_compliance_status():
     return {
@@ -285,7 +912,8 @@ def get_compliance_status():
 async def log_event(user_id: str, query_id: str, action_type: str, details: dict):
     """
     Logs an event to Supabase and streams it to the frontend.
-    action_type: 'LLM_THINK', 'TOOL_EXEC', 'ERROR', 'SYSTEM', 'EXECUTION_SUCCESS', 'EXECUTION_FAIL'
+    action_type: 'TASK_START', 'LLM_THINK', 'TOOL_EXEC', 'ERROR', 'SYSTEM', 'LLM_RESPONSE',
+                 'EXECUTION_SUCCESS', 'EXECUTION_FAIL', 'EXECUTION_CANCELLED'
     """
     timestamp = datetime.now().isoformat()
     
@@ -311,34 +939,357 @@ async def log_event(user_id: str, query_id: str, action_type: str, details: dict
         }
         # We use a background task or just await it. For simplicity, awaiting.
         # Note: Ensure 'agent_audit_logs' table exists.
-        supabase.table('agent_audit_logs').insert(audit_data).execute()
+        get_supabase().table('agent_audit_logs').insert(audit_data).execute()
     except Exception as e:
         print(f"[Audit] Failed to save log: {e}")
 
 
 # --- ⚡ Execution Engine with ReAct Loop & Stealth Mode ---
 
+# --- 📸 Screenshot Capture Service ---
+
+CAPTURE_MAX_FPS = float(os.getenv("CAPTURE_MAX_FPS", "10"))
+CAPTURE_ACTIVE_WINDOW_SECONDS = 5.0
+
+class CaptureService:
+    """
+    Host-wide screenshot pipeline. Frames are skipped when nobody is watching the
+    user's socket, and a shared frames-per-second budget is split evenly between
+    sessions that captured recently. A skipped frame leaves one trailing capture
+    queued so the client still ends up with the latest page state.
+    JPEGs are sent as binary WebSocket frames, so no encoding runs on the event loop.
+    """
+    def __init__(self, max_fps: float):
+        self.max_fps = max_fps
+        self.bucket = TokenBucket(max_fps, max(1.0, max_fps))
+        self.last_capture: dict[str, float] = {}
+        self.trailing: dict[str, asyncio.Task] = {}
+        self.stats: dict[str, dict] = {}
+
+    def session_interval(self, user_id: str) -> float:
+        """Minimum seconds between frames for one session given its fair share of the budget."""
+        now = time.monotonic()
+        active = 1 + sum(
+            1 for uid, last in self.last_capture.items()
+            if uid != user_id and now - last < CAPTURE_ACTIVE_WINDOW_SECONDS
+        )
+        return active / self.max_fps
+
+    async def capture(self, page, user_id: str):
+        stats = self.stats.setdefault(user_id, {
+            "captures": 0, "skipped_budget": 0, "skipped_unsubscribed": 0,
+            "bytes_sent": 0, "capture_wall_ms": 0.0
+        })
+        if user_id not in manager.active_connections:
+            stats["skipped_unsubscribed"] += 1
+            return
+
+        since_last = time.monotonic() - self.last_capture.get(user_id, 0.0)
+        wait = max(self.session_interval(user_id) - since_last, self.bucket.time_until())
+        if wait > 0:
+            stats["skipped_budget"] += 1
+            self._schedule_trailing(page, user_id, wait)
+            return
+
+        self.bucket.consume()
+        self.last_capture[user_id] = time.monotonic()
+        try:
+            if page.is_closed():
+                return
+            start = time.perf_counter()
+            frame = await page.screenshot(type='jpeg', quality=50)
+            await manager.send_bytes(user_id, frame)
+            stats["captures"] += 1
+            stats["bytes_sent"] += len(frame)
+            stats["capture_wall_ms"] += elapsed_ms(start)
+        except Exception as e:
+            print(f"[Stream] Capture Error: {e}")
+
+    def _schedule_trailing(self, page, user_id: str, delay: float):
+        pending = self.trailing.get(user_id)
+        if pending and not pending.done():
+            return
+        self.trailing[user_id] = asyncio.create_task(self._trailing_capture(page, user_id, delay))
+
+    async def _trailing_capture(self, page, user_id: str, delay: float):
+        await asyncio.sleep(delay)
+        self.trailing.pop(user_id, None)
+        await self.capture(page, user_id)
+
+    def snapshot(self) -> dict:
+        return {
+            "max_fps": self.max_fps,
+            "sessions": {
+                user_id: {
+                    **{k: round(v, 1) if isinstance(v, float) else v for k, v in stats.items()},
+                    "avg_capture_ms": round(stats["capture_wall_ms"] / stats["captures"], 1) if stats["captures"] else 0.0,
+                }
+                for user_id, stats in self.stats.items()
+            }
+        }
+
+    def shutdown(self):
+        for task in self.trailing.values():
+            task.cancel()
+        self.trailing.clear()
+
+capture_service = CaptureService(CAPTURE_MAX_FPS)
+
 async def capture_and_stream(page, user_id: str):
-    """Captures screenshot and streams to frontend via WebSocket"""
+    """Captures screenshot and streams to frontend via WebSocket, within the host capture budget"""
+    await capture_service.capture(page, user_id)
+
+# --- 🧰 Tool Handlers ---
+
+@tool_registry.tool("task_complete", terminal=True)
+async def task_complete(ctx: ToolContext, args: dict) -> str:
+    return args['final_answer']
+
+@tool_registry.tool("wait_for_user", timeout=max(TOOL_TIMEOUT_SECONDS, WAIT_FOR_USER_MAX_SECONDS + 10))
+async def wait_for_user(ctx: ToolContext, args: dict) -> str:
+    seconds = min(args.get('seconds', 30), WAIT_FOR_USER_MAX_SECONDS)
+    for i in range(seconds):
+        if i % 5 == 0: await capture_and_stream(ctx.page, ctx.user_id)
+        await asyncio.sleep(1)
+    return f"Waited for {seconds} seconds."
+
+@tool_registry.tool("send_gmail")
+async def send_gmail(ctx: ToolContext, args: dict) -> str:
+    message = MIMEText(args['body'])
+    message['to'] = args['recipient']
+    message['subject'] = args['subject']
+    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    res = await rate_limited_call(
+        "gmail", ctx.user_id,
+        requests.post,
+        'https://gmail.googleapis.com/gmail/v1/users/me/messages/send',
+        headers={'Authorization': f'Bearer {ctx.access_token}'},
+        json={'raw': raw_message},
+        timeout=TOOL_TIMEOUT_SECONDS
+    )
+    if res.status_code == 200:
+        return f"Email sent successfully to {args['recipient']}"
+    return f"Failed to send email: {res.text}"
+
+@tool_registry.tool("create_google_doc")
+async def create_google_doc(ctx: ToolContext, args: dict) -> str:
+    res = await rate_limited_call(
+        "docs", ctx.user_id,
+        requests.post,
+        'https://docs.googleapis.com/v1/documents',
+        headers={'Authorization': f'Bearer {ctx.access_token}'},
+        json={'title': args['title']},
+        timeout=TOOL_TIMEOUT_SECONDS
+    )
+    if res.status_code != 200:
+        return f"Failed to create doc: {res.text}"
+    doc_id = res.json().get('documentId')
+    await rate_limited_call(
+        "docs", ctx.user_id,
+        requests.post,
+        f'https://docs.googleapis.com/v1/documents/{doc_id}:batchUpdate',
+        headers={'Authorization': f'Bearer {ctx.access_token}'},
+        json={
+            "requests": [
+                {
+                    "insertText": {
+                        "text": args['content'],
+                        "endOfSegmentLocation": {"segmentId": ""}
+                    }
+                }
+            ]
+        },
+        timeout=TOOL_TIMEOUT_SECONDS
+    )
+    return f"Created Google Doc '{args['title']}' with ID: {doc_id}"
+
+@tool_registry.tool("browser_navigate")
+async def browser_navigate(ctx: ToolContext, args: dict) -> str:
+    await ctx.page.goto(args['url'])
+    await capture_and_stream(ctx.page, ctx.user_id)
+    return f"Navigated to {args['url']}"
+
+@tool_registry.tool("browser_click")
+async def browser_click(ctx: ToolContext, args: dict) -> str:
+    await ctx.page.click(args['selector'], timeout=5000)
+    await capture_and_stream(ctx.page, ctx.user_id)
+    return f"Clicked element {args['selector']}"
+
+@tool_registry.tool("browser_type")
+async def browser_type(ctx: ToolContext, args: dict) -> str:
+    await ctx.page.fill(args['selector'], args['text'], timeout=5000)
+    await ctx.page.press(args['selector'], 'Enter') # Auto-press enter for convenience
+    await capture_and_stream(ctx.page, ctx.user_id)
+    return f"Typed '{args['text']}' into {args['selector']} and pressed Enter"
+
+@tool_registry.tool("browser_get_content")
+async def browser_get_content(ctx: ToolContext, args: dict) -> str:
+    page = ctx.page
+    # Enhanced content extraction with Popup Handling
     try:
-        if not page.is_closed():
-            screenshot_bytes = await page.screenshot(type='jpeg', quality=50)
-            base64_str = base64.b64encode(screenshot_bytes).decode('utf-8')
-            await manager.send_payload(user_id, {"type": "image", "data": base64_str})
+        # 1. Attempt to handle Cookie Popups (Google, etc.)
+        popup_selectors = [
+            "button[id='L2AGLb']", # Google 'Accept all'
+            "button:has-text('Accept all')",
+            "button:has-text('I agree')",
+            "button:has-text('Accept cookies')",
+            "[aria-label='Accept all']"
+        ]
+        for selector in popup_selectors:
+            try:
+                if await page.locator(selector).is_visible(timeout=500):
+                    print(f"[Browser] Dismissing popup with selector: {selector}")
+                    await page.click(selector)
+                    await asyncio.sleep(1) # Wait for dismissal
+                    break
+            except: pass
+
+        # 2. Wait for content to settle
+        try:
+            await page.wait_for_load_state('networkidle', timeout=3000)
+        except:
+            await asyncio.sleep(2) # Fallback wait
+
+        # 3. Smart Extraction
+        # Try to find the main content area first to avoid nav/footer noise
+        main_content = ""
+        target_selectors = ["main", "#search", "#rso", "div[role='main']", "body"]
+
+        for selector in target_selectors:
+            try:
+                if await page.locator(selector).count() > 0:
+                    main_content = await page.locator(selector).first.inner_text()
+                    if len(main_content) > 100:
+                        print(f"[Browser] Extracted content from '{selector}'")
+                        break
+            except: pass
+
+        if not main_content:
+            main_content = await page.evaluate("document.body.innerText")
+
+        if not main_content or len(main_content) < 50:
+            # Fallback to HTML if text is too short
+            main_content = await page.content()
+
+        truncated = main_content[:4000]
+        return f"Page Content: {truncated}..."
     except Exception as e:
-        print(f"[Stream] Capture Error: {e}")
+        return f"Error reading content: {str(e)}"
+
+async def stream_llm_step(user_id: str, query_id: str, step: int, messages: list, on_tool_call, finished: asyncio.Event):
+    """
+    Streams one THINK step, relaying reasoning text and tool-call argument deltas
+    to the frontend as "llm_delta" payloads. Each tool call is handed to
+    on_tool_call as soon as its arguments are complete (the next call starts or
+    the stream ends). Stops reading early once `finished` is set.
+    Returns (content, tool_calls) in the assistant-message dict format.
+    """
+    stream = await rate_limited_acall(
+        "openai:gpt-4o", user_id,
+        get_openai_client().chat.completions.create,
+        model="gpt-4o",
+        messages=messages,
+        tools=tool_registry.definitions(),
+        tool_choice="auto",
+        stream=True
+    )
+    content_parts = []
+    tool_calls = []
+    try:
+        async for chunk in stream:
+            if finished.is_set():
+                break
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if delta.content:
+                content_parts.append(delta.content)
+                await manager.send_payload(user_id, {"type": "llm_delta", "data": {
+                    "query_id": query_id, "step": step, "kind": "content", "delta": delta.content
+                }})
+
+            for tool_delta in delta.tool_calls or []:
+                if tool_delta.index >= len(tool_calls):
+                    # A new call starting means the previous one's arguments are complete
+                    if tool_calls:
+                        on_tool_call(tool_calls[-1])
+                    tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                call = tool_calls[tool_delta.index]
+                if tool_delta.id:
+                    call["id"] = tool_delta.id
+                if tool_delta.function and tool_delta.function.name:
+                    call["function"]["name"] += tool_delta.function.name
+                if tool_delta.function and tool_delta.function.arguments:
+                    call["function"]["arguments"] += tool_delta.function.arguments
+                    await manager.send_payload(user_id, {"type": "llm_delta", "data": {
+                        "query_id": query_id, "step": step, "kind": "tool_args",
+                        "index": tool_delta.index, "tool": call["function"]["name"],
+                        "delta": tool_delta.function.arguments
+                    }})
+    finally:
+        await stream.close()
+
+    if tool_calls and not finished.is_set():
+        on_tool_call(tool_calls[-1])
+    return "".join(content_parts) or None, tool_calls
+
+async def execute_tool_calls(ready_calls: asyncio.Queue, step: int, page, user_id: str, query_id: str, access_token: str, finished: asyncio.Event):
+    """
+    Executes tool calls in order as the stream completes them; a None item ends the batch.
+    Returns (tool messages, final_answer); final_answer is set when task_complete is called.
+    """
+    observations = []
+    ctx = ToolContext(page, user_id, query_id, access_token)
+    while (tool_call := await ready_calls.get()) is not None:
+        tool_name = tool_call["function"]["name"]
+        call_id = tool_call["id"]
+        tool, args, observation = tool_registry.resolve(tool_name, tool_call["function"]["arguments"])
+
+        if tool is None:
+            # Rejected before dispatch; the structured error goes back to the model
+            print(f"[ReAct] Rejected: {tool_name} {observation}")
+            await log_event(user_id, query_id, "ERROR", {"tool": tool_name, "error": json.loads(observation)})
+        else:
+            print(f"[ReAct] Action: {tool_name} args: {args}")
+            await manager.send_payload(user_id, {"type": "status", "data": f"Step {step}: {tool_name}..."})
+            await log_event(user_id, query_id, "TOOL_EXEC", {"tool": tool_name, "args": args})
 
-async def execute_react_loop(user_id: str, initial_query: str, access_token: str):
+            # 3. OBSERVE (Execute Tool)
+            try:
+                observation = await tool_registry.call(tool, ctx, args)
+                if tool.terminal:
+                    finished.set()
+                    return observations, observation
+            except asyncio.TimeoutError:
+                observation = f"Error executing {tool_name}: timed out after {int(tool.timeout)}s"
+                print(f"[ReAct] Error: {observation}")
+                await log_event(user_id, query_id, "ERROR", {"tool": tool_name, "error": "timeout"})
+            except Exception as e:
+                observation = f"Error executing {tool_name}: {str(e)}"
+                print(f"[ReAct] Error: {observation}")
+                await log_event(user_id, query_id, "ERROR", {"tool": tool_name, "error": str(e)})
+
+        # 4. FEEDBACK (Collected and added to history after the assistant message)
+        observations.append({
+            "tool_call_id": call_id,
+            "role": "tool",
+            "name": tool_name,
+            "content": observation
+        })
+    return observations, None
+
+async def execute_react_loop(user_id: str, initial_query: str, access_token: str, query_id: str = None):
     """
     Executes the continuous ReAct loop: Think -> Act -> Observe -> Repeat
+    Browser resources are always released in the finally block, including on cancellation.
     """
-    global playwright_instance
     browser = None
     context = None
     page = None
     
     # Generate a unique Query ID for this session
-    query_id = f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{random.randint(1000,9999)}"
+    query_id = query_id or new_query_id()
     
     # Conversation History
     messages = [
@@ -364,54 +1315,60 @@ IMPORTANT RULES:
 
     try:
         print(f"[ReAct] Starting Loop. QueryID: {query_id}")
-        await log_event(user_id, query_id, "SYSTEM", {"message": f"Starting task: {initial_query}"})
+        await log_event(user_id, query_id, "TASK_START", {"message": f"Starting task: {initial_query}", "query": initial_query})
         
-        # Use global instance
+        # Use global instance (waits for warm-up on a cold replica)
+        playwright_instance = await get_playwright()
         if not playwright_instance:
              err_msg = "System Error: Browser Engine not ready."
              print(f"[ReAct] Error: {err_msg}")
              await log_event(user_id, query_id, "ERROR", {"error": err_msg})
+             await log_event(user_id, query_id, "EXECUTION_FAIL", {"reason": err_msg})
              return f"❌ {err_msg}"
         
         # --- 🕵️ Browser Launch Strategy ---
         user_data_dir = os.path.join(os.path.expanduser("~"), "AppData", "Local", "Google", "Chrome", "User Data")
         using_real_profile = False
 
-        try:
-            print(f"[ReAct] Attempting to launch Real Chrome Profile from: {user_data_dir}")
-            context = await playwright_instance.chromium.launch_persistent_context(
-                user_data_dir,
-                channel="chrome",
-                headless=False,
-                args=["--disable-blink-features=AutomationControlled", "--no-sandbox"],
-                viewport={"width": 1920, "height": 1080}
-            )
-            using_real_profile = True
-            print("[ReAct] ✅ Successfully attached to Real Chrome Profile!")
-            await manager.send_payload(user_id, {"type": "status", "data": "✅ Using your Real Chrome Profile"})
-            await log_event(user_id, query_id, "SYSTEM", {"message": "Attached to Real Chrome Profile"})
+        async with task_manager.attributing_launch(query_id):
+            try:
+                print(f"[ReAct] Attempting to launch Real Chrome Profile from: {user_data_dir}")
+                context = await playwright_instance.chromium.launch_persistent_context(
+                    user_data_dir,
+                    channel="chrome",
+                    headless=False,
+                    args=["--disable-blink-features=AutomationControlled", "--no-sandbox"],
+                    viewport={"width": 1920, "height": 1080}
+                )
+                task_manager.track_browser(query_id, context, browser)
+                using_real_profile = True
+                print("[ReAct] ✅ Successfully attached to Real Chrome Profile!")
+                await manager.send_payload(user_id, {"type": "status", "data": "✅ Using your Real Chrome Profile"})
+                await log_event(user_id, query_id, "SYSTEM", {"message": "Attached to Real Chrome Profile"})
             
-        except Exception as e:
-            print(f"[ReAct] ⚠️ Could not use Real Profile (Chrome likely open). Falling back to Stealth Mode. Error: {e}")
-            await manager.send_payload(user_id, {"type": "status", "data": "⚠️ Main Chrome is busy. Close it to use your saved login, or log in manually here."})
-            await log_event(user_id, query_id, "SYSTEM", {"message": "Fallback to Temporary Profile (Chrome Locked)", "error": str(e)})
+            except Exception as e:
+                print(f"[ReAct] ⚠️ Could not use Real Profile (Chrome likely open). Falling back to Stealth Mode. Error: {e}")
+                await manager.send_payload(user_id, {"type": "status", "data": "⚠️ Main Chrome is busy. Close it to use your saved login, or log in manually here."})
+                await log_event(user_id, query_id, "SYSTEM", {"message": "Fallback to Temporary Profile (Chrome Locked)", "error": str(e)})
             
-            # Fallback: Launch fresh browser
-            user_agents = [
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            ]
-            browser = await playwright_instance.chromium.launch(
-                headless=False,
-                args=["--disable-blink-features=AutomationControlled", "--no-sandbox", "--disable-infobars", "--start-maximized"]
-            )
-            context = await browser.new_context(
-                user_agent=random.choice(user_agents),
-                viewport={"width": 1920, "height": 1080},
-                java_script_enabled=True
-            )
-            # Inject stealth script
-            await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+                # Fallback: Launch fresh browser
+                user_agents = [
+                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+                    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+                ]
+                browser = await playwright_instance.chromium.launch(
+                    headless=False,
+                    args=["--disable-blink-features=AutomationControlled", "--no-sandbox", "--disable-infobars", "--start-maximized"]
+                )
+                task_manager.track_browser(query_id, context, browser)
+                context = await browser.new_context(
+                    user_agent=random.choice(user_agents),
+                    viewport={"width": 1920, "height": 1080},
+                    java_script_enabled=True
+                )
+                task_manager.track_browser(query_id, context, browser)
+                # Inject stealth script
+                await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
 
         # Get the page
         if context.pages:
@@ -431,190 +1388,60 @@ IMPORTANT RULES:
             # 1. THINK (Call LLM)
             await log_event(user_id, query_id, "LLM_THINK", {"step": loop_count, "messages_count": len(messages)})
             
-            completion = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                tools=tools,
-                tool_choice="auto"
+            # 2. ACT while streaming: tools start as soon as their arguments are complete
+            ready_calls = asyncio.Queue()
+            finished = asyncio.Event()
+            executor = asyncio.create_task(
+                execute_tool_calls(ready_calls, loop_count, page, user_id, query_id, access_token, finished)
             )
-            
-            response_message = completion.choices[0].message
-            messages.append(response_message) 
-
-            # 2. ACT (Check for tool calls)
-            if response_message.tool_calls:
-                for tool_call in response_message.tool_calls:
-                    tool_name = tool_call.function.name
-                    args = json.loads(tool_call.function.arguments)
-                    call_id = tool_call.id
-                    
-                    print(f"[ReAct] Action: {tool_name} args: {args}")
-                    await manager.send_payload(user_id, {"type": "status", "data": f"Step {loop_count}: {tool_name}..."})
-                    await log_event(user_id, query_id, "TOOL_EXEC", {"tool": tool_name, "args": args})
-
-                    observation = ""
-                    
-                    # 3. OBSERVE (Execute Tool)
-                    try:
-                        if tool_name == "task_complete":
-                            final_answer = args['final_answer']
-                            await manager.send_payload(user_id, {"type": "status", "data": "✅ Task Completed"})
-                            await log_event(user_id, query_id, "EXECUTION_SUCCESS", {"final_answer": final_answer})
-                            
-                            # Cleanup
-                            if context: await context.close()
-                            if browser: await browser.close()
-                            # DO NOT STOP PLAYWRIGHT HERE
-                            return final_answer
-
-                        elif tool_name == "wait_for_user":
-                            seconds = args.get('seconds', 30)
-                            for i in range(seconds):
-                                if i % 5 == 0: await capture_and_stream(page, user_id)
-                                await asyncio.sleep(1)
-                            observation = f"Waited for {seconds} seconds."
-
-                        elif tool_name == "send_gmail":
-                            message = MIMEText(args['body'])
-                            message['to'] = args['recipient']
-                            message['subject'] = args['subject']
-                            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-                            res = requests.post(
-                                'https://gmail.googleapis.com/gmail/v1/users/me/messages/send',
-                                headers={'Authorization': f'Bearer {access_token}'},
-                                json={'raw': raw_message}
-                            )
-                            if res.status_code == 200:
-                                observation = f"Email sent successfully to {args['recipient']}"
-                            else:
-                                observation = f"Failed to send email: {res.text}"
-
-                        elif tool_name == "create_google_doc":
-                            res = requests.post(
-                                'https://docs.googleapis.com/v1/documents',
-                                headers={'Authorization': f'Bearer {access_token}'},
-                                json={'title': args['title']}
-                            )
-                            if res.status_code == 200:
-                                doc_id = res.json().get('documentId')
-                                requests.post(
-                                    f'https://docs.googleapis.com/v1/documents/{doc_id}:batchUpdate',
-                                    headers={'Authorization': f'Bearer {access_token}'},
-                                    json={
-                                        "requests": [
-                                            {
-                                                "insertText": {
-                                                    "text": args['content'],
-                                                    "endOfSegmentLocation": {"segmentId": ""}
-                                                }
-                                            }
-                                        ]
-                                    }
-                                )
-                                observation = f"Created Google Doc '{args['title']}' with ID: {doc_id}"
-                            else:
-                                observation = f"Failed to create doc: {res.text}"
-
-                        elif tool_name == "browser_navigate":
-                            await page.goto(args['url'])
-                            await capture_and_stream(page, user_id)
-                            observation = f"Navigated to {args['url']}"
-
-                        elif tool_name == "browser_click":
-                            await page.click(args['selector'], timeout=5000)
-                            await capture_and_stream(page, user_id)
-                            observation = f"Clicked element {args['selector']}"
-
-                        elif tool_name == "browser_type":
-                            await page.fill(args['selector'], args['text'], timeout=5000)
-                            await page.press(args['selector'], 'Enter') # Auto-press enter for convenience
-                            await capture_and_stream(page, user_id)
-                            observation = f"Typed '{args['text']}' into {args['selector']} and pressed Enter"
-
-                        elif tool_name == "browser_get_content":
-                            # Enhanced content extraction with Popup Handling
-                            try:
-                                # 1. Attempt to handle Cookie Popups (Google, etc.)
-                                popup_selectors = [
-                                    "button[id='L2AGLb']", # Google 'Accept all'
-                                    "button:has-text('Accept all')",
-                                    "button:has-text('I agree')",
-                                    "button:has-text('Accept cookies')",
-                                    "[aria-label='Accept all']"
-                                ]
-                                for selector in popup_selectors:
-                                    try:
-                                        if await page.locator(selector).is_visible(timeout=500):
-                                            print(f"[Browser] Dismissing popup with selector: {selector}")
-                                            await page.click(selector)
-                                            await asyncio.sleep(1) # Wait for dismissal
-                                            break
-                                    except: pass
-
-                                # 2. Wait for content to settle
-                                try:
-                                    await page.wait_for_load_state('networkidle', timeout=3000)
-                                except:
-                                    await asyncio.sleep(2) # Fallback wait
-
-                                # 3. Smart Extraction
-                                # Try to find the main content area first to avoid nav/footer noise
-                                main_content = ""
-                                target_selectors = ["main", "#search", "#rso", "div[role='main']", "body"]
-                                
-                                for selector in target_selectors:
-                                    try:
-                                        if await page.locator(selector).count() > 0:
-                                            main_content = await page.locator(selector).first.inner_text()
-                                            if len(main_content) > 100:
-                                                print(f"[Browser] Extracted content from '{selector}'")
-                                                break
-                                    except: pass
-                                
-                                if not main_content:
-                                    main_content = await page.evaluate("document.body.innerText")
-
-                                if not main_content or len(main_content) < 50:
-                                    # Fallback to HTML if text is too short
-                                    main_content = await page.content()
-                            
-                                truncated = main_content[:4000] 
-                                observation = f"Page Content: {truncated}..."
-                            except Exception as e:
-                                observation = f"Error reading content: {str(e)}"
-
-                    except Exception as e:
-                        observation = f"Error executing {tool_name}: {str(e)}"
-                        print(f"[ReAct] Error: {observation}")
-                        await log_event(user_id, query_id, "ERROR", {"tool": tool_name, "error": str(e)})
-
-                    # 4. FEEDBACK (Add observation to history)
-                    messages.append({
-                        "tool_call_id": call_id,
-                        "role": "tool",
-                        "name": tool_name,
-                        "content": observation
-                    })
+            try:
+                content, tool_calls = await stream_llm_step(
+                    user_id, query_id, loop_count, messages, ready_calls.put_nowait, finished
+                )
+                ready_calls.put_nowait(None)
+                observations, final_answer = await executor
+            finally:
+                if not executor.done():
+                    executor.cancel()
+
+            assistant_message = {"role": "assistant", "content": content}
+            if tool_calls:
+                assistant_message["tool_calls"] = tool_calls
+            messages.append(assistant_message)
+
+            if final_answer is not None:
+                await manager.send_payload(user_id, {"type": "status", "data": "✅ Task Completed"})
+                await log_event(user_id, query_id, "EXECUTION_SUCCESS", {"final_answer": final_answer})
+                return final_answer
+
+            if tool_calls:
+                messages.extend(observations)
             else:
                 print("[ReAct] LLM replied without tool.")
-                await log_event(user_id, query_id, "LLM_RESPONSE", {"content": response_message.content})
-                return response_message.content
+                await log_event(user_id, query_id, "LLM_RESPONSE", {"content": content})
+                return content
 
-        if context: await context.close()
-        if browser: await browser.close()
-        # DO NOT STOP PLAYWRIGHT HERE
         await log_event(user_id, query_id, "EXECUTION_FAIL", {"reason": "Max steps reached"})
         return "❌ Task timed out (max steps reached)."
 
+    except asyncio.CancelledError:
+        reason = task_manager.cancel_reason(query_id)
+        print(f"[ReAct] Cancelled {query_id}: {reason}")
+        await manager.send_payload(user_id, {"type": "status", "data": f"🛑 Task cancelled: {reason}"})
+        await log_event(user_id, query_id, "EXECUTION_CANCELLED", {"reason": reason})
+        return f"❌ Task cancelled: {reason}"
+
     except Exception as e:
         print(f"[ReAct] Critical Error: {e}")
         await log_event(user_id, query_id, "ERROR", {"error": str(e), "traceback": traceback.format_exc()})
-        try:
-            if context: await context.close()
-            if browser: await browser.close()
-        except: pass
+        await log_event(user_id, query_id, "EXECUTION_FAIL", {"reason": str(e)})
         return f"❌ Critical Error: {str(e)}"
 
+    finally:
+        # DO NOT STOP PLAYWRIGHT HERE
+        await close_browser_resources(context, browser)
+        task_manager.release_browser(query_id)
+
 
 # --- Routes ---
 
@@ -622,21 +1449,45 @@ IMPORTANT RULES:
 def read_root():
     return {"status": "BrowUser.ai Backend is Running (Python)"}
 
+@app.get("/healthz")
+def liveness():
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readiness():
+    ready = all(state == "ready" for state in engine_state.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "mode": STARTUP_MODE, "engines": engine_state}
+    )
+
+@app.get("/api/startup/profile")
+def startup_profile():
+    return {
+        "mode": STARTUP_MODE,
+        "engines": engine_state,
+        "startup_ms": startup_timings,
+        "import_ms": dict(sorted(import_timings.items(), key=lambda item: -item[1])),
+    }
+
 @app.websocket("/ws/live-preview/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await manager.connect(websocket, user_id)
+    task_manager.clear_disconnect_cancel(user_id)
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
     except Exception as e:
         print(f"[WS] Error: {e}")
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
+    if user_id not in manager.active_connections:
+        task_manager.schedule_disconnect_cancel(user_id)
 
 @app.get("/auth/google")
 def login_google():
-    flow = Flow.from_client_config(
+    flow = lazy_import("google_auth_oauthlib.flow").Flow.from_client_config(
         {
             "web": {
                 "client_id": GOOGLE_CLIENT_ID,
@@ -658,7 +1509,7 @@ def login_google():
     return RedirectResponse(authorization_url)
 
 @app.get("/auth/google/callback")
-def callback_google(code: str):
+async def callback_google(code: str, request: Request):
     try:
         token_url = "https://oauth2.googleapis.com/token"
         data = {
@@ -669,13 +1520,16 @@ def callback_google(code: str):
             'grant_type': 'authorization_code'
         }
         
-        response = requests.post(token_url, data=data)
+        # No user id yet, so the caller's address is the per-user key
+        client_key = request.client.host if request.client else "anonymous"
+        response = await rate_limited_call("oauth_token", client_key, requests.post, token_url, data=data)
         tokens = response.json()
         
         if 'error' in tokens:
             raise Exception(tokens['error'])
 
-        user_info_response = requests.get(
+        user_info_response = await asyncio.to_thread(
+            requests.get,
             'https://www.googleapis.com/oauth2/v2/userinfo',
             headers={'Authorization': f"Bearer {tokens['access_token']}"}
         )
@@ -687,9 +1541,9 @@ def callback_google(code: str):
             "display_name": user_profile.get('name', ''),
         }
         
-        supabase.table('users').upsert(user_data, on_conflict='google_id').execute()
+        get_supabase().table('users').upsert(user_data, on_conflict='google_id').execute()
         
-        user_db = supabase.table('users').select('id').eq('google_id', user_profile['id']).single().execute()
+        user_db = get_supabase().table('users').select('id').eq('google_id', user_profile['id']).single().execute()
         user_id = user_db.data['id']
 
         if 'refresh_token' in tokens:
@@ -698,7 +1552,7 @@ def callback_google(code: str):
                 "service": "google",
                 "refresh_token": encrypt_token(tokens['refresh_token']),
             }
-            supabase.table('oauth_tokens').upsert(token_data, on_conflict='user_id').execute()
+            get_supabase().table('oauth_tokens').upsert(token_data, on_conflict='user_id').execute()
             
         return RedirectResponse(f"http://localhost:3000/dashboard?status=success&uid={user_id}")
 
@@ -717,17 +1571,27 @@ async def chat_query(chat_req: ChatQuery):
     
     try:
         # 1. Get Valid Token
-        access_token = get_valid_access_token(chat_req.userId)
+        access_token = await get_valid_access_token(chat_req.userId)
         
-        # 2. Execute ReAct Loop
-        final_response = await execute_react_loop(chat_req.userId, chat_req.query, access_token)
+        # 2. Execute ReAct Loop as a tracked, cancellable task
+        query_id = new_query_id()
+        task = asyncio.create_task(execute_react_loop(chat_req.userId, chat_req.query, access_token, query_id))
+        task_manager.register(query_id, chat_req.userId, task)
+        await manager.send_payload(chat_req.userId, {"type": "task_started", "data": {"query_id": query_id}})
+        final_response = await task
         
-        return {"response": {"message": final_response}}
+        return {"response": {"message": final_response, "query_id": query_id}}
         
     except Exception as e:
         print(f"Chat Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/cancel/{user_id}/{query_id}")
+async def cancel_query(user_id: str, query_id: str):
+    if task_manager.task_owners.get(query_id) != user_id or not task_manager.cancel(query_id, "Cancelled by user"):
+        raise HTTPException(status_code=404, detail="No running task with that id")
+    return {"status": "cancelling", "query_id": query_id}
+
 class SaveAutomationRequest(BaseModel):
     user_id: str
     name: str
@@ -744,7 +1608,7 @@ async def save_automation(req: SaveAutomationRequest):
             "usage_count": 1
         }
         # Assuming table 'saved_automations' exists
-        supabase.table('saved_automations').insert(data).execute()
+        get_supabase().table('saved_automations').insert(data).execute()
         return {"status": "success", "message": "Automation saved successfully"}
     except Exception as e:
         print(f"Save Error: {e}")
@@ -753,7 +1617,7 @@ async def save_automation(req: SaveAutomationRequest):
 @app.get("/api/automation/list/{user_id}")
 async def list_automations(user_id: str):
     try:
-        response = supabase.table('saved_automations').select('*').eq('user_id', user_id).execute()
+        response = get_supabase().table('saved_automations').select('*').eq('user_id', user_id).execute()
         return {"automations": response.data}
     except Exception as e:
         # Check if it's a "relation not found" error (PGRST205)
@@ -769,7 +1633,7 @@ async def analyze_automations(user_id: str):
         # Fetch saved automations
         saved_automations = []
         try:
-            saved_response = supabase.table('saved_automations').select('*').eq('user_id', user_id).execute()
+            saved_response = get_supabase().table('saved_automations').select('*').eq('user_id', user_id).execute()
             saved_automations = saved_response.data
         except Exception as e:
              if "PGRST205" in str(e) or "relation" in str(e) and "does not exist" in str(e):
@@ -793,7 +1657,9 @@ async def analyze_automations(user_id: str):
         Example: [{{"suggestion_title": "Automate Weekly Report", "estimated_time_saved": "15 mins"}}]
         """
         
-        completion = openai.chat.completions.create(
+        completion = await rate_limited_call(
+            "openai:gpt-4o", user_id,
+            get_openai().chat.completions.create,
             model="gpt-4o",
             messages=[{"role": "system", "content": prompt}]
         )
@@ -816,6 +1682,154 @@ async def analyze_automations(user_id: str):
             {"suggestion_title": "Competitor Research", "estimated_time_saved": "30 mins"}
         ]}
 
+# --- 🧾 Execution Traces ---
+
+TRACE_PAGE_DEFAULT = 50
+TRACE_PAGE_MAX = 200
+TRACE_CACHE_MAX_ENTRIES = int(os.getenv("TRACE_CACHE_MAX_ENTRIES", "1000"))
+TERMINAL_ACTION_TYPES = ["EXECUTION_SUCCESS", "EXECUTION_FAIL", "EXECUTION_CANCELLED", "LLM_RESPONSE"]
+TASK_STATUS_BY_ACTION = {
+    "EXECUTION_SUCCESS": "completed",
+    "LLM_RESPONSE": "completed",
+    "EXECUTION_FAIL": "failed",
+    "EXECUTION_CANCELLED": "cancelled",
+}
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor: str) -> tuple:
+    """Returns (created_at, row_id) re-serialised from parsed values, never the raw client text."""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(row_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(cursor: str, op: str) -> str:
+    """PostgREST filter for rows strictly after the cursor in (created_at, id) order."""
+    created_at, row_id = decode_cursor(cursor)
+    return f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{row_id})'
+
+def page_limit(limit: int) -> int:
+    return max(1, min(limit, TRACE_PAGE_MAX))
+
+class TraceCache:
+    """LRU of trace pages for finished tasks; finished traces never change, so entries never go stale."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.pages: OrderedDict = OrderedDict()
+        self.finished: OrderedDict = OrderedDict()
+
+    def get(self, key: tuple):
+        if key in self.pages:
+            self.pages.move_to_end(key)
+            return self.pages[key]
+        return None
+
+    def put(self, key: tuple, page: dict):
+        self.pages[key] = page
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.max_entries:
+            self.pages.popitem(last=False)
+
+    def mark_finished(self, query_id: str):
+        self.finished[query_id] = True
+        self.finished.move_to_end(query_id)
+        while len(self.finished) > self.max_entries:
+            self.finished.popitem(last=False)
+
+    def is_finished(self, query_id: str) -> bool:
+        if query_id in self.finished:
+            self.finished.move_to_end(query_id)
+            return True
+        if query_id in task_manager.running_tasks:
+            return False
+        response = get_supabase().table('agent_audit_logs').select('id').eq('query_id', query_id) \
+            .in_('action_type', TERMINAL_ACTION_TYPES).limit(1).execute()
+        if response.data:
+            self.mark_finished(query_id)
+            return True
+        return False
+
+trace_cache = TraceCache(TRACE_CACHE_MAX_ENTRIES)
+
+@app.get("/api/traces/list/{user_id}")
+async def list_traces(user_id: str, limit: int = TRACE_PAGE_DEFAULT, cursor: str = None):
+    """Lists a user's tasks newest first. Served by the partial TASK_START index."""
+    limit = page_limit(limit)
+    try:
+        query = get_supabase().table('agent_audit_logs').select('id, created_at, query_id, details') \
+            .eq('user_id', user_id).eq('action_type', 'TASK_START')
+        if cursor:
+            query = query.or_(keyset_filter(cursor, 'lt'))
+        response = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute()
+        rows = response.data[:limit]
+        has_more = len(response.data) > limit
+
+        # One indexed lookup for the status of the whole page
+        statuses = {}
+        query_ids = [row['query_id'] for row in rows]
+        if query_ids:
+            terminal = get_supabase().table('agent_audit_logs').select('query_id, action_type') \
+                .in_('query_id', query_ids).in_('action_type', TERMINAL_ACTION_TYPES).execute()
+            for event in terminal.data:
+                statuses[event['query_id']] = TASK_STATUS_BY_ACTION[event['action_type']]
+
+        tasks = [{
+            "query_id": row['query_id'],
+            "query": (row.get('details') or {}).get('query', ''),
+            "created_at": row['created_at'],
+            "status": statuses.get(row['query_id'], "in_progress"),
+        } for row in rows]
+        return {"tasks": tasks, "next_cursor": encode_cursor(rows[-1]) if has_more else None}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Trace List Error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch traces")
+
+@app.get("/api/traces/{user_id}/{query_id}")
+async def get_trace(user_id: str, query_id: str, limit: int = TRACE_PAGE_DEFAULT, cursor: str = None):
+    """Returns one task's events oldest first. Pages of finished tasks are cached."""
+    limit = page_limit(limit)
+    cache_key = (user_id, query_id, cursor, limit)
+    cached = trace_cache.get(cache_key)
+    if cached:
+        return cached
+    try:
+        # Checked before the fetch: a task finishing mid-request must not yield a cached, truncated page
+        finished = trace_cache.is_finished(query_id)
+
+        query = get_supabase().table('agent_audit_logs').select('id, created_at, action_type, details') \
+            .eq('query_id', query_id).eq('user_id', user_id)
+        if cursor:
+            query = query.or_(keyset_filter(cursor, 'gt'))
+        response = query.order('created_at').order('id').limit(limit + 1).execute()
+        rows = response.data[:limit]
+        has_more = len(response.data) > limit
+
+        if not finished and any(row['action_type'] in TERMINAL_ACTION_TYPES for row in rows):
+            finished = True
+            trace_cache.mark_finished(query_id)
+
+        # Running tasks keep a tail cursor so the client can poll for new events
+        page = {
+            "query_id": query_id,
+            "finished": finished,
+            "events": rows,
+            "next_cursor": encode_cursor(rows[-1]) if rows and (has_more or not finished) else None,
+        }
+        if finished:
+            trace_cache.put(cache_key, page)
+        return page
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Trace Fetch Error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch trace")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000)
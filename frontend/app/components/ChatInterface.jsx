@@ -77,6 +77,14 @@ export default function ChatInterface() {
         };
 
         ws.onmessage = (event) => {
+            // Live preview frames arrive as raw JPEG bytes
+            if (event.data instanceof Blob) {
+                const reader = new FileReader();
+                reader.onload = () => setLiveImage(reader.result);
+                reader.readAsDataURL(new Blob([event.data], { type: 'image/jpeg' }));
+                return;
+            }
+
             try {
                 const payload = JSON.parse(event.data);
 
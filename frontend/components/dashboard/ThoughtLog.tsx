@@ -36,6 +36,23 @@ export default function ThoughtLog() {
             };
             setLogs(prev => [...prev, newLog]);
         });
+
+        // Streamed LLM output: append each delta to the entry for its step / tool call
+        socket.on('llm_delta', (data: any) => {
+            const id = `${data.query_id}-${data.step}-${data.kind}-${data.index ?? 0}`;
+            setLogs(prev => {
+                const existing = prev.find(log => log.id === id);
+                if (existing) {
+                    return prev.map(log => log.id === id ? { ...log, message: log.message + data.delta } : log);
+                }
+                return [...prev, {
+                    id,
+                    timestamp: new Date().toLocaleTimeString([], { hour12: false }),
+                    type: 'plan',
+                    message: data.kind === 'tool_args' ? `${data.tool}: ${data.delta}` : data.delta
+                }];
+            });
+        });
     }, []);
 
     useEffect(() => {
@@ -55,7 +55,8 @@ export function useWebSocket() {
                         setStreamStatus('active');
                         trigger('frame', base64);
                     };
-                    reader.readAsDataURL(event.data);
+                    // Frames arrive as raw JPEG bytes
+                    reader.readAsDataURL(new Blob([event.data], { type: 'image/jpeg' }));
                     return;
                 }
 